@@ -2,11 +2,22 @@
 Flask web application for JStory - Story Search System using RAG.
 """
 
+import hashlib
+import json
 import os
-from flask import Flask, render_template, request, jsonify
+import sqlite3
+import ssl
+import threading
+from contextlib import contextmanager
+from functools import wraps
+import faiss
+import httpx
+import numpy as np
+import orjson
+from flask import Flask, Response, render_template, request, stream_with_context
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
 
 # Load environment variables (optional - will work with terminal env vars too)
 try:
@@ -15,77 +26,395 @@ try:
 except ImportError:
     pass  # dotenv not needed if using terminal environment variables
 
-# Configure SSL certificates for Windows
-# This must be done BEFORE importing httpx or OpenAI clients
-try:
-    import certifi
-    import ssl
-    # Set SSL certificate path for httpx/requests
-    os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
-    os.environ['SSL_CERT_FILE'] = certifi.where()
-    os.environ['HTTPX_CA_BUNDLE'] = certifi.where()
-except ImportError:
-    pass  # certifi not available, will use default
+app = Flask(__name__)
 
-# For Windows SSL certificate issues, patch httpx to disable verification globally
-# WARNING: This is NOT secure and should only be used for local POC development
-# In production, you should properly configure SSL certificates
-import ssl
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Query cache settings
+QUERY_CACHE_PATH = "./query_cache.db"
+SEMANTIC_CACHE_THRESHOLD = 0.97  # Minimum cosine similarity to reuse a past answer
+QUERY_CACHE_MAX_ENTRIES = 1024  # Oldest entries are evicted beyond this
+QUERY_CACHE_SCHEMA = "2"  # Bump to discard entries written in an older format
 
-# Patch httpx to use verify=False by default (POC workaround)
-try:
-    import httpx
-    _original_client_init = httpx.Client.__init__
-    def _patched_client_init(self, *args, verify=None, **kwargs):
-        if verify is None:
-            verify = False  # Disable SSL verification for POC
-        return _original_client_init(self, *args, verify=verify, **kwargs)
-    httpx.Client.__init__ = _patched_client_init
-    
-    # Also patch AsyncClient
-    _original_async_client_init = httpx.AsyncClient.__init__
-    def _patched_async_client_init(self, *args, verify=None, **kwargs):
-        if verify is None:
-            verify = False  # Disable SSL verification for POC
-        return _original_async_client_init(self, *args, verify=verify, **kwargs)
-    httpx.AsyncClient.__init__ = _patched_async_client_init
-except Exception:
-    pass  # If patching fails, continue anyway
+# Embedding model assumed for vector databases built before the model name
+# was recorded in the collection metadata
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
 
-app = Flask(__name__)
+# TLS settings for OpenAI calls, built once by configure_tls()
+CA_BUNDLE = None
+SSL_CONTEXT = None
+
+def configure_tls():
+    """
+    Build the SSL context used for OpenAI calls from certifi's CA bundle
+    (fixes certificate errors on Windows). Only clients created here use it;
+    the process-wide trust store is left alone. Safe to call more than once.
+    """
+    global CA_BUNDLE, SSL_CONTEXT
+    if SSL_CONTEXT is not None:
+        return
+    try:
+        import certifi
+        CA_BUNDLE = certifi.where()
+    except ImportError:
+        CA_BUNDLE = None  # certifi not available, will use default
+    SSL_CONTEXT = ssl.create_default_context(cafile=CA_BUNDLE)
+
+@contextmanager
+def ca_bundle_env():
+    """
+    Point requests/httpx at CA_BUNDLE through their environment variables
+    while the block runs, for downloads made by libraries we cannot pass a
+    client to. The previous values are restored afterwards.
+    """
+    names = ('REQUESTS_CA_BUNDLE', 'SSL_CERT_FILE', 'HTTPX_CA_BUNDLE')
+    saved = {name: os.environ.get(name) for name in names}
+    if CA_BUNDLE:
+        os.environ.update(dict.fromkeys(names, CA_BUNDLE))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+# Connection pool shared by the OpenAI embedding and chat clients
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=30)
+
+# Search index settings
+CHROMA_PATH = "./chroma_db"
+INDEX_EXPORT_PATH = "./search_index"  # Read-only export written by process_stories.py
+HNSW_MIN_VECTORS = 50000  # Switch from exact to HNSW search above this many stories
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+# Vectors are stored as fp16 (half the memory, twice the scan bandwidth of fp32);
+# QT_8bit quarters memory but dropped recall@3 below 0.99 on the story corpus
+INDEX_QUANTIZER = faiss.ScalarQuantizer.QT_fp16
+INDEX_ADD_BATCH = 16384  # Vectors converted to fp32 and added to the index at a time
+
+class QueryCache:
+    """
+    Two-level cache of search results keyed by query.
+    Exact matches are looked up by normalized query text; near-duplicates are
+    found by cosine similarity against the embeddings of past queries.
+    Entries are persisted to SQLite so they survive restarts and are shared
+    between worker processes. The cache records the embedding model and index
+    it was filled from, and is cleared when either changes.
+    At most max_entries entries are kept, oldest evicted first. Only query
+    keys and embeddings are held in memory; stories and answers are read from
+    SQLite when a lookup hits.
+    """
+
+    def __init__(self, path, embedding_model, index_fingerprint, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS query_cache_info (key TEXT PRIMARY KEY, value TEXT)")
+        self._check_source({
+            'schema': QUERY_CACHE_SCHEMA,
+            'embedding_model': embedding_model,
+            'index_fingerprint': index_fingerprint,
+        })
+        
+        # Embeddings live in a ring of max_entries rows, overwritten oldest first
+        self.keys = [None] * max_entries
+        self.slots = {}  # Query key -> row in self.matrix
+        self.matrix = None  # Allocated once the embedding dimension is known
+        self.count = 0
+        self.next_slot = 0
+        rows = self.conn.execute(
+            "SELECT query, embedding FROM query_cache ORDER BY rowid DESC LIMIT ?", (max_entries,)
+        ).fetchall()
+        for query, embedding in reversed(rows):
+            self._remember(query, np.frombuffer(embedding, dtype=np.float32))
+
+    def _check_source(self, source):
+        """Drop every entry if the cache was filled from a different model, index or schema."""
+        stored = dict(self.conn.execute("SELECT key, value FROM query_cache_info"))
+        if stored != source:
+            # Old query vectors may not even have the current model's dimension
+            self.conn.execute("DROP TABLE IF EXISTS query_cache")
+            self.conn.execute("DELETE FROM query_cache_info")
+            self.conn.executemany("INSERT INTO query_cache_info VALUES (?, ?)", source.items())
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            "query TEXT PRIMARY KEY, embedding BLOB, stories TEXT, rag_response TEXT)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def normalize(query):
+        """Normalize a query so trivially different spellings share an entry."""
+        return " ".join(query.lower().split())
+
+    def _remember(self, key, vector):
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.next_slot
+            evicted = self.keys[slot]
+            if evicted is not None:
+                del self.slots[evicted]
+            self.keys[slot] = key
+            self.slots[key] = slot
+            self.next_slot = (slot + 1) % self.max_entries
+            self.count = min(self.count + 1, self.max_entries)
+        self.matrix[slot] = vector
+
+    def get(self, key):
+        """Return the cached (stories, rag_response) for an exact query, or None."""
+        with self.lock:
+            # Read from SQLite, which also sees entries other workers have added
+            row = self.conn.execute(
+                "SELECT embedding, stories, rag_response FROM query_cache WHERE query = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if key not in self.slots:
+                self._remember(key, np.frombuffer(row[0], dtype=np.float32))
+            return json.loads(row[1]), row[2]
+
+    def get_similar(self, embedding):
+        """Return the cached (stories, rag_response) of the closest past query, or None."""
+        with self.lock:
+            if not self.count:
+                return None
+            scores = self.matrix[:self.count] @ self._unit(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            row = self.conn.execute(
+                "SELECT stories, rag_response FROM query_cache WHERE query = ?", (self.keys[best],)
+            ).fetchone()
+            if row is None:
+                return None  # Evicted by another worker
+            return json.loads(row[0]), row[1]
+
+    def put(self, key, embedding, stories, rag_response):
+        """Store a search result for a query and its embedding."""
+        vector = self._unit(embedding)
+        with self.lock:
+            self._remember(key, vector)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)",
+                (key, vector.tobytes(), json.dumps(stories), rag_response),
+            )
+            # Keep only the newest max_entries rows (a replaced row gets a new rowid)
+            self.conn.execute(
+                "DELETE FROM query_cache WHERE rowid <= "
+                "(SELECT rowid FROM query_cache ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+# RAG prompt, parsed once at import
+# Characters of each story included in the prompt. Indexes built from stories
+# split at ingestion record their own (larger) limit, which is used instead.
+MAX_STORY_CONTEXT_CHARS = 2000
+RAG_PROMPT = PromptTemplate.from_template("""Based on the following stories retrieved from a database, please provide a helpful response to the user's query.
+
+User Query: {query}
+
+Retrieved Stories:
+{context}
+
+Please:
+1. Identify which story (or stories) best match the user's query
+2. Provide a brief summary of why each story is relevant
+3. If multiple stories match, explain how they relate to the query
+
+Keep your response concise and focused on helping the user find the right story.""")
 
 # Initialize components
-embeddings = None
-vector_store = None
-llm = None
+# The search index is built once at import, so under gunicorn's preload_app it
+# is shared copy-on-write by every worker. API clients and the SQLite query
+# cache are created lazily per process, after the fork.
+embedding_model = LEGACY_EMBEDDING_MODEL
+search_index = None
+index_fingerprint = None  # Identifies the stories in the index, for the query cache
+story_context_chars = MAX_STORY_CONTEXT_CHARS
+story_columns = {}  # Column name -> list of values, parallel to the index positions
 initialization_error = None
 
+def story_columns_from_metadata(texts, metadatas):
+    """
+    Turn Chroma documents and metadata into story columns (lists parallel to
+    the index positions) with metadata defaults already applied, so a search
+    only needs to index into them.
+    """
+    metadatas = [meta or {} for meta in metadatas]
+    return {
+        'text': list(texts),
+        'source': [meta.get('source', 'Unknown') for meta in metadatas],
+        'type': [meta.get('type', 'story') for meta in metadatas],
+        'number': [meta.get('number', 'N/A') for meta in metadatas],
+        'length': [meta.get('length', len(text)) for meta, text in zip(metadatas, texts)],
+    }
+
+def fingerprint_stories(texts):
+    """Return a hash identifying the stories an index was built from."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def load_index_export(export_path):
+    """
+    Load the read-only index export written by process_stories.py: fp16
+    vectors memory-mapped from vectors.npy and story columns from stories.json.
+    Also returns the embedding model and the longest story length, if the
+    stories were split to a maximum length at ingestion.
+    """
+    vectors = np.load(os.path.join(export_path, "vectors.npy"), mmap_mode='r')
+    with open(os.path.join(export_path, "stories.json"), 'r', encoding='utf-8') as f:
+        export = json.load(f)
+    return (
+        vectors,
+        export['columns'],
+        export.get('embedding_model', LEGACY_EMBEDDING_MODEL),
+        export.get('max_story_chars'),
+    )
+
+def load_chroma(chroma_path):
+    """
+    Read every vector and story from a Chroma database. Used when no index
+    export is available (databases built before exports were written).
+    Vectors are L2-normalized, as in the export.
+    """
+    from langchain_community.vectorstores import Chroma
+    
+    # The Chroma store is only read here to build the index, so forked
+    # workers never use its SQLite connection
+    store = Chroma(persist_directory=chroma_path)
+    data = store._collection.get(include=['embeddings', 'documents', 'metadatas'])
+    collection_metadata = store._collection.metadata or {}
+    vectors = np.asarray(data['embeddings'], dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return (
+        vectors,
+        story_columns_from_metadata(data['documents'], data['metadatas']),
+        collection_metadata.get('embedding_model', LEGACY_EMBEDDING_MODEL),
+        collection_metadata.get('max_story_chars'),
+    )
+
+def build_search_index(vectors):
+    """
+    Build an in-memory FAISS index over L2-normalized story vectors, so inner
+    product equals cosine similarity. Vectors are stored scalar-quantized;
+    queries stay fp32. The (possibly memory-mapped fp16) input is converted
+    to fp32 one batch at a time rather than copied whole.
+    """
+    dim = vectors.shape[1]
+    if len(vectors) >= HNSW_MIN_VECTORS:
+        index = faiss.IndexHNSWSQ(dim, INDEX_QUANTIZER, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        index = faiss.IndexScalarQuantizer(dim, INDEX_QUANTIZER, faiss.METRIC_INNER_PRODUCT)
+    # fp16 quantization needs no statistics, so one batch is enough to train on
+    index.train(vectors[:INDEX_ADD_BATCH].astype(np.float32, copy=False))
+    for start in range(0, len(vectors), INDEX_ADD_BATCH):
+        index.add(vectors[start:start + INDEX_ADD_BATCH].astype(np.float32, copy=False))
+    return index
+
+def create_embeddings(model_name, http_client=None):
+    """Create a local sentence-transformers or OpenAI embedding client for a model name."""
+    if model_name.startswith("sentence-transformers/"):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        # The model is downloaded from the Hugging Face Hub on first use
+        with ca_bundle_env():
+            return HuggingFaceEmbeddings(
+                model_name=model_name,
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"normalize_embeddings": True}
+            )
+    return OpenAIEmbeddings(model=model_name, http_client=http_client)
+
+def per_process(factory):
+    """
+    Cache a zero-argument factory's result for this process. Creation is
+    locked, so concurrent first requests in a threaded worker build one
+    instance between them. Call cache_clear() in a forked worker.
+    """
+    state = {}
+    
+    @wraps(factory)
+    def getter():
+        if 'value' not in state:
+            with state['lock']:
+                if 'value' not in state:
+                    state['value'] = factory()
+        return state['value']
+    
+    def cache_clear():
+        state.clear()
+        state['lock'] = threading.Lock()
+    
+    getter.cache_clear = cache_clear
+    cache_clear()
+    return getter
+
+@per_process
+def get_http_client():
+    """
+    Return this process's HTTP/2 client for OpenAI calls, creating it on first use.
+    Sharing one client keeps connections to api.openai.com alive between calls.
+    """
+    return httpx.Client(http2=True, verify=SSL_CONTEXT, limits=HTTP_LIMITS, timeout=60.0)
+
+@per_process
+def get_embeddings():
+    """Return this process's query embedding client, creating it on first use."""
+    return create_embeddings(embedding_model, http_client=get_http_client())
+
+@per_process
+def get_llm():
+    """Return this process's LLM client, creating it on first use."""
+    return ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7, http_client=get_http_client())
+
+@per_process
+def get_query_cache():
+    """Return this process's query cache, opening its SQLite connection on first use."""
+    return QueryCache(QUERY_CACHE_PATH, embedding_model, index_fingerprint)
+
+def reset_process_state():
+    """Forget per-process clients so a forked worker creates its own."""
+    get_http_client.cache_clear()
+    get_embeddings.cache_clear()
+    get_llm.cache_clear()
+    get_query_cache.cache_clear()
+
 def initialize_components():
-    """Initialize embeddings, vector store, and LLM."""
-    global embeddings, vector_store, llm, initialization_error
+    """Load the story vectors into the in-memory search index."""
+    global embedding_model, initialization_error
+    global search_index, story_columns, index_fingerprint, story_context_chars
     
     try:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key or api_key == "your_openai_api_key_here":
             raise ValueError("OPENAI_API_KEY not set as environment variable")
         
-        # Initialize embeddings and LLM
-        # SSL verification is disabled globally via httpx patch above
-        # This allows OpenAIEmbeddings and ChatOpenAI to create their own clients internally
-        embeddings = OpenAIEmbeddings()
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
+        # Load the index export if there is one, otherwise read the vector store
+        # (embed queries with the same model the database was built with)
+        if os.path.exists(os.path.join(INDEX_EXPORT_PATH, "vectors.npy")):
+            vectors, story_columns, embedding_model, max_story_chars = load_index_export(INDEX_EXPORT_PATH)
+        elif os.path.exists(CHROMA_PATH):
+            vectors, story_columns, embedding_model, max_story_chars = load_chroma(CHROMA_PATH)
+        else:
+            raise ValueError(f"Vector database not found at {CHROMA_PATH}! The chroma_db directory must be included in your deployment. Check that it's not in .gitignore and is committed to your repository.")
         
-        # Load vector store
-        chroma_path = "./chroma_db"
-        if not os.path.exists(chroma_path):
-            raise ValueError(f"Vector database not found at {chroma_path}! The chroma_db directory must be included in your deployment. Check that it's not in .gitignore and is committed to your repository.")
-        
-        vector_store = Chroma(
-            persist_directory=chroma_path,
-            embedding_function=embeddings
-        )
+        search_index = build_search_index(vectors)
+        index_fingerprint = fingerprint_stories(story_columns['text'])
+        # Stories split at ingestion already fit the prompt whole
+        story_context_chars = max(MAX_STORY_CONTEXT_CHARS, max_story_chars or 0)
         
         initialization_error = None
         print("✓ Components initialized successfully")
@@ -94,64 +423,69 @@ def initialize_components():
         print(f"✗ Error initializing application: {e}")
         raise
 
-def search_stories(query, k=3):
+def search_stories(query, k=3, query_embedding=None):
     """
     Search for stories using RAG.
-    Returns top k matching stories.
+    Returns top k matching stories. Pass query_embedding when the query has
+    already been embedded to avoid embedding it again.
     """
-    if not vector_store:
+    if search_index is None:
         raise ValueError("Vector store not initialized")
     
     # Step 1: RETRIEVE - Find similar stories
-    results = vector_store.similarity_search_with_score(query, k=k)
+    if query_embedding is None:
+        query_embedding = get_embeddings().embed_query(query)
+    query_vector = np.asarray([query_embedding], dtype=np.float32)
+    faiss.normalize_L2(query_vector)
+    scores, ids = search_index.search(query_vector, k)
     
     # Format results
     stories = []
-    for doc, score in results:
-        stories.append({
-            'text': doc.page_content,
-            'source': doc.metadata.get('source', 'Unknown'),
-            'type': doc.metadata.get('type', 'story'),
-            'number': doc.metadata.get('number', 'N/A'),
-            'similarity_score': float(score)
-        })
+    for score, idx in zip(scores[0].tolist(), ids[0].tolist()):
+        if idx < 0:
+            continue  # Fewer than k stories in the index
+        story = {column: values[idx] for column, values in story_columns.items()}
+        story['similarity_score'] = 1.0 - score  # Cosine distance, lower is closer
+        stories.append(story)
     
     return stories
 
-def generate_response(query, stories):
+def build_prompt(query, stories):
     """
-    Generate a response using RAG (Retrieval-Augmented Generation).
+    Build the RAG prompt from the user's query and the retrieved stories.
     """
-    if not llm:
-        raise ValueError("LLM not initialized")
-    
     # Step 2: AUGMENT - Build context from retrieved stories
-    context = ""
+    parts = []
     for i, story in enumerate(stories, 1):
-        context += f"\n\n--- Story {i} (from {story['source']}) ---\n"
-        # Truncate very long stories for context
+        parts.append(f"\n\n--- Story {i} (from {story['source']}) ---\n")
+        # Truncate very long stories for context (only stories from databases
+        # built before stories were split at ingestion are this long)
         story_text = story['text']
-        if len(story_text) > 2000:
-            story_text = story_text[:2000] + "..."
-        context += story_text
+        parts.append(story_text[:story_context_chars])
+        if len(story_text) > story_context_chars:
+            parts.append("...")
+    context = "".join(parts)
     
-    # Step 3: GENERATE - Create prompt and call LLM
-    prompt = f"""Based on the following stories retrieved from a database, please provide a helpful response to the user's query.
+    return RAG_PROMPT.format(query=query, context=context)
 
-User Query: {query}
-
-Retrieved Stories:
-{context}
+def stream_response(query, stories):
+    """
+    Generate a response using RAG (Retrieval-Augmented Generation).
+    Yields the response text incrementally as the LLM produces it.
+    """
+    # Step 3: GENERATE - Stream the LLM's answer to the prompt
+    for chunk in get_llm().stream(build_prompt(query, stories)):
+        if chunk.content:
+            yield chunk.content
 
-Please:
-1. Identify which story (or stories) best match the user's query
-2. Provide a brief summary of why each story is relevant
-3. If multiple stories match, explain how they relate to the query
+def _json(obj, status=200):
+    """Return a JSON response serialized with orjson."""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
 
-Keep your response concise and focused on helping the user find the right story."""
-    
-    response = llm.invoke(prompt)
-    return response.content
+def sse_event(data, event=None):
+    """Format a JSON payload as a Server-Sent Events message."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {orjson.dumps(data).decode()}\n\n"
 
 @app.route('/')
 def index():
@@ -165,51 +499,74 @@ def search():
     
     # Check if initialization failed
     if initialization_error:
-        return jsonify({
+        return _json({
             'error': f'Application not initialized: {initialization_error}'
-        }), 503
+        }, 503)
     
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
         
         if not query:
-            return jsonify({'error': 'Query is required'}), 400
+            return _json({'error': 'Query is required'}, 400)
         
         # Ensure components are initialized
-        if not vector_store:
-            return jsonify({
+        if search_index is None:
+            return _json({
                 'error': 'Vector store not initialized. Please check server logs for initialization errors.'
-            }), 503
+            }, 503)
         
-        # Search for top 3 matching stories
-        stories = search_stories(query, k=3)
+        # Reuse the answer for an identical or near-identical earlier query
+        query_cache = get_query_cache()
+        cache_key = query_cache.normalize(query)
+        cached = query_cache.get(cache_key)
+        if cached is None:
+            query_embedding = get_embeddings().embed_query(query)
+            cached = query_cache.get_similar(query_embedding)
         
-        # Generate RAG response
-        rag_response = generate_response(query, stories)
+        if cached is not None:
+            stories, rag_response = cached
+        else:
+            # Search for top 3 matching stories
+            stories = search_stories(query, k=3, query_embedding=query_embedding)
+            rag_response = None
         
-        return jsonify({
-            'success': True,
-            'query': query,
-            'stories': stories,
-            'rag_response': rag_response
-        })
+        def generate():
+            # Stories are sent first so the page can render them while the LLM is still answering
+            yield sse_event({'success': True, 'query': query, 'stories': stories}, event='stories')
+            try:
+                if rag_response is not None:
+                    yield sse_event({'delta': rag_response})
+                else:
+                    # Generate RAG response
+                    parts = []
+                    for delta in stream_response(query, stories):
+                        parts.append(delta)
+                        yield sse_event({'delta': delta})
+                    query_cache.put(cache_key, query_embedding, stories, "".join(parts))
+                yield sse_event({}, event='done')
+            except Exception as e:
+                yield sse_event({'error': str(e)}, event='error')
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
     
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return _json({'error': str(e)}, 500)
 
 @app.route('/health')
 def health():
     """Health check endpoint."""
     try:
-        if vector_store is None:
-            return jsonify({'status': 'not_ready', 'message': 'Vector store not initialized'}), 503
-        return jsonify({'status': 'healthy'}), 200
+        if search_index is None:
+            return _json({'status': 'not_ready', 'message': 'Vector store not initialized'}, 503)
+        return _json({'status': 'healthy'}, 200)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return _json({'status': 'error', 'message': str(e)}, 500)
 
 # Initialize components when the app starts (works with both Flask dev server and gunicorn)
 print("Initializing JStory application...")
+configure_tls()
 try:
     initialize_components()
 except Exception as e:
@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for JStory.
+Run with: gunicorn app:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# Each worker loads its own embedding model after the fork, so keep the worker
+# count small and get concurrency from threads instead
+MAX_DEFAULT_WORKERS = 4
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, MAX_DEFAULT_WORKERS)))
+
+# Threaded workers so a streamed search response does not block the whole
+# worker while the LLM is generating, and browser connections are kept alive
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+keepalive = 30
+
+# Import the app (and build the search index) once in the master process so
+# workers share the index's memory pages instead of each loading their own copy
+preload_app = True
+
+def post_fork(server, worker):
+    """Make each worker open its own API clients and SQLite connections."""
+    from app import reset_process_state
+    reset_process_state()
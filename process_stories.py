@@ -3,13 +3,28 @@ Script to process story files, split them into chunks (one story per chunk),
 create embeddings, and store them in ChromaDB.
 """
 
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import mmap
 import os
+import random
 import re
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from contextlib import contextmanager
 from pathlib import Path
+import numpy as np
+from openai import RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
+import chromadb
+import chromadb.errors
 
 # Load environment variables (optional - will work with terminal env vars too)
 try:
@@ -18,259 +33,612 @@ try:
 except ImportError:
     pass  # dotenv not needed if using terminal environment variables
 
-# Configure SSL certificates for Windows
-# This must be done BEFORE importing httpx or OpenAI clients
+# CA bundle trusted by this script's HTTPS clients (certifi fixes certificate
+# errors on Windows). Only the clients created here use it; the process-wide
+# trust store is left alone.
 try:
     import certifi
-    import ssl
-    # Set SSL certificate path for httpx/requests
-    os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
-    os.environ['SSL_CERT_FILE'] = certifi.where()
-    os.environ['HTTPX_CA_BUNDLE'] = certifi.where()
+    CA_BUNDLE = certifi.where()
 except ImportError:
-    pass  # certifi not available, will use default
+    CA_BUNDLE = None  # certifi not available, will use default
 
-# For Windows SSL certificate issues, patch httpx to disable verification globally
-# WARNING: This is NOT secure and should only be used for local POC development
-# In production, you should properly configure SSL certificates
 import ssl
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import httpx
 
-# Patch httpx to use verify=False by default (POC workaround)
-try:
-    import httpx
-    _original_client_init = httpx.Client.__init__
-    def _patched_client_init(self, *args, verify=None, **kwargs):
-        if verify is None:
-            verify = False  # Disable SSL verification for POC
-        return _original_client_init(self, *args, verify=verify, **kwargs)
-    httpx.Client.__init__ = _patched_client_init
+# Connection pool for OpenAI embedding requests. HTTP/2 lets concurrent
+# batches share a connection, and keeping connections alive avoids a TLS
+# handshake per batch
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+HTTP_TIMEOUT = 60.0
+
+# Embedding model used to build the vector database. Local sentence-transformers
+# models avoid an API round-trip per query; set EMBEDDING_MODEL to an OpenAI
+# model name (e.g. text-embedding-3-small) to use OpenAI instead.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Longest story stored in the vector database (about 1500 tokens); longer
+# stories are split with some overlap
+MAX_STORY_CHARS = 6000
+STORY_CHUNK_OVERLAP = 200
+# Stories embedded per batch (per HTTP request for OpenAI models)
+EMBEDDING_BATCH_SIZE = 256
+# Embedding batches sent concurrently
+EMBEDDING_CONCURRENCY = 8
+# Maximum random delay (seconds) before each batch is first sent
+EMBEDDING_START_JITTER = 0.2
+# Embeddings of previously processed stories, reused on later runs
+EMBEDDING_CACHE_PATH = "./embedding_cache.db"
+
+# Vector database location; the collection name is LangChain's default so
+# app.py can keep opening it through the LangChain Chroma wrapper
+CHROMA_PATH = "./chroma_db"
+CHROMA_COLLECTION = "langchain"
+
+# Documents are embedded and written to Chroma in batches of this size while
+# later files are still being extracted; at most INGEST_MAX_PENDING batches
+# are in flight, so memory stays bounded by batches rather than the corpus
+INGEST_BATCH_SIZE = EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY
+INGEST_MAX_PENDING = 2
+# Documents held back (in batches) so each batch sent can be the longest
+# ones seen so far, keeping batch lengths similar without sorting the corpus
+INGEST_HEAP_BATCHES = 4
+
+@contextmanager
+def ca_bundle_env():
+    """
+    Point requests/httpx at CA_BUNDLE through their environment variables
+    while the block runs, for downloads made by libraries we cannot pass a
+    client to. The previous values are restored afterwards.
+    """
+    names = ('REQUESTS_CA_BUNDLE', 'SSL_CERT_FILE', 'HTTPX_CA_BUNDLE')
+    saved = {name: os.environ.get(name) for name in names}
+    if CA_BUNDLE:
+        os.environ.update(dict.fromkeys(names, CA_BUNDLE))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def create_embeddings(model_name):
+    """Create a local sentence-transformers or OpenAI embedding client for a model name."""
+    if model_name.startswith("sentence-transformers/"):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        # The model is downloaded from the Hugging Face Hub on first use
+        with ca_bundle_env():
+            return HuggingFaceEmbeddings(
+                model_name=model_name,
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"normalize_embeddings": True, "batch_size": EMBEDDING_BATCH_SIZE}
+            )
+    # One SSL context (CA bundle parsed once) shared by both clients
+    ssl_context = ssl.create_default_context(cafile=CA_BUNDLE)
+    return OpenAIEmbeddings(
+        model=model_name,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        http_client=httpx.Client(http2=True, verify=ssl_context, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+        http_async_client=httpx.AsyncClient(http2=True, verify=ssl_context, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+# Patterns used to strip Project Gutenberg boilerplate and split books into stories
+# Single-line Gutenberg notices (no DOTALL, so a match can never span the book)
+_GUTENBERG_NOTICE_RE = re.compile(r'Project Gutenberg[^\n]*www\.gutenberg\.org[^\n]*\n')
+# Pattern 1: Chapter headings (CHAPTER I, Chapter 1, etc.)
+_CHAPTER_RE = re.compile(r'(?:^|\n)(?:CHAPTER|Chapter)\s+[IVXLCDM0-9]+[\.:]?\s*\n', re.IGNORECASE)
+# Pattern 2: Numbered stories (1., 2., etc.)
+_NUMBERED_RE = re.compile(r'(?:^|\n)\d+[\.\)]\s+[A-Z]', re.IGNORECASE)
+# Pattern 3: Story titles in all caps or with specific formatting
+_TITLE_RE = re.compile(r'(?:^|\n)(?:THE\s+)?[A-Z][A-Z\s]{10,}\n', re.IGNORECASE)
+# Paragraph breaks
+_PARA_RE = re.compile(r'\n\n+')
+# Sentence endings ('. ', '!\n', ...) where a fixed-size chunk may be cut
+_SENT_END_RE = re.compile(r'[.!?][ \n]')
+# Whitespace skipped between fixed-size chunks
+_WS_RE = re.compile(r'[ \n\t]+')
+# Common story separators, tried in order
+_SEPARATOR_RES = tuple(re.compile(p) for p in (
+    r'\n\n\n+',  # Triple newlines
+    r'\n\s*[A-Z][A-Z\s]{15,}\n',  # All caps titles
+    r'\n\s*\d+\.\s+[A-Z]',  # Numbered items
+    r'\n\s*[IVX]+\.\s+[A-Z]',  # Roman numerals
+))
+
+def _split_spans(pattern, content):
+    """
+    Return the (start, end) spans of the pieces re.split would produce for
+    pattern, so callers can slice only the pieces they keep.
+    """
+    spans = []
+    start = 0
+    for match in pattern.finditer(content):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(content)))
+    return spans
+
+def _strip_span(text, a, b):
+    """Return the span of text[a:b].strip() as offsets into text."""
+    while a < b and text[a].isspace():
+        a += 1
+    while b > a and text[b - 1].isspace():
+        b -= 1
+    return a, b
+
+def read_text_file(filepath):
+    """
+    Read a UTF-8 text file through a memory map. The text is decoded straight
+    from the mapped pages, without first copying the whole file into a bytes
+    object, and line endings are normalized to \\n as text mode would.
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            content = str(mm, 'utf-8', 'replace')
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+# Stories needed for a splitting strategy to count as having worked, and for
+# its result to be kept instead of falling back to fixed-size chunks
+MIN_STORIES = 3
+MIN_STORIES_PER_BOOK = 10
+
+def _try_chapters(content, filename):
+    """Split on chapter headings."""
+    texts, metas = [], []
+    chapters = _split_spans(_CHAPTER_RE, content)
+    if len(chapters) > 2:  # If we found chapters
+        for i, (a, b) in enumerate(chapters[1:], 1):
+            if b - a <= 100:  # Too short even before stripping
+                continue
+            chapter = content[a:b].strip()
+            if len(chapter) > 100:  # Minimum story length
+                texts.append(chapter)
+                metas.append({'source': filename, 'type': 'chapter', 'number': i, 'story_id': f"{filename}_chapter_{i}"})
+    return texts, metas
+
+def _try_numbered(content, filename):
+    """Split on numbered story headings (1., 2., ...)."""
+    texts, metas = [], []
+    numbered = _split_spans(_NUMBERED_RE, content)
+    if len(numbered) > 2:
+        for i, (a, b) in enumerate(numbered[1:], 1):
+            if b - a <= 100:
+                continue
+            story = content[a:b].strip()
+            if len(story) > 100:
+                texts.append(story)
+                metas.append({'source': filename, 'type': 'story', 'number': i, 'story_id': f"{filename}_story_{i}"})
+    return texts, metas
+
+def _try_paragraphs(content, filename, min_paragraphs, min_story_len):
+    """Group consecutive paragraphs into stories."""
+    texts, metas = [], []
+    # Split by double newlines (paragraph breaks)
+    paragraphs = _PARA_RE.split(content)
+    # Group paragraphs into stories (stories are typically 2+ paragraphs for shorter stories)
+    current_story = []
+    current_len = 0  # len('\n\n'.join(current_story)), tracked without joining
+    story_num = 1
     
-    # Also patch AsyncClient
-    _original_async_client_init = httpx.AsyncClient.__init__
-    def _patched_async_client_init(self, *args, verify=None, **kwargs):
-        if verify is None:
-            verify = False  # Disable SSL verification for POC
-        return _original_async_client_init(self, *args, verify=verify, **kwargs)
-    httpx.AsyncClient.__init__ = _patched_async_client_init
-except Exception:
-    pass  # If patching fails, continue anyway
-
-def extract_stories_from_file(filepath):
+    for para in paragraphs:
+        para = para.strip()
+        if len(para) > 50:
+            if current_story:
+                current_len += 2
+            current_story.append(para)
+            current_len += len(para)
+            # Make a story if we have 2+ paragraphs and it's substantial
+            if len(current_story) >= min_paragraphs and current_len > min_story_len:
+                texts.append('\n\n'.join(current_story))
+                metas.append({'source': filename, 'type': 'story', 'number': story_num, 'story_id': f"{filename}_story_{story_num}"})
+                current_story = []
+                current_len = 0
+                story_num += 1
+    
+    # Add remaining paragraphs as last story
+    if current_story and current_len > min_story_len:
+        texts.append('\n\n'.join(current_story))
+        metas.append({'source': filename, 'type': 'story', 'number': story_num, 'story_id': f"{filename}_story_{story_num}"})
+    return texts, metas
+
+def _try_separators(content, filename):
+    """Split on the first common section separator that yields enough stories."""
+    texts, metas = [], []
+    # Try splitting by multiple newlines or section markers
+    for sep_re in _SEPARATOR_RES:
+        parts = _split_spans(sep_re, content)
+        if len(parts) > 3:
+            texts, metas = [], []
+            for i, (a, b) in enumerate(parts, 1):
+                if b - a <= 200:
+                    continue
+                part = content[a:b].strip()
+                if len(part) > 200:  # Minimum story length
+                    texts.append(part)
+                    metas.append({'source': filename, 'type': 'section', 'number': i, 'story_id': f"{filename}_section_{i}"})
+            if len(texts) >= MIN_STORIES:
+                break
+    return texts, metas
+
+def _try_fixed_chunks(content, filename):
+    """
+    Split into chunks of reasonable size, ending at sentence boundaries where
+    possible. This ensures we get multiple stories even from unstructured books.
+    """
+    texts, metas = [], []
+    if len(content) > 1000:
+        # Split into smaller chunks (1000-1500 characters) to get more stories
+        # Smaller chunks = more stories
+        chunk_size = 1200  # Smaller chunks for more stories
+        # Chunks are tracked as [a, b) offsets into content and only
+        # sliced once accepted, so rejected chunks are never copied
+        length = len(content)
+        start = 0
+        
+        while start < length:
+            end = start + chunk_size
+            a, b = _strip_span(content, start, min(end, length))
+            
+            # Try to end at a sentence boundary for better story breaks
+            if end < length:
+                # Look for sentence endings in the last 30% of chunk
+                search_start = int((b - a) * 0.7)
+                last = None
+                for last in _SENT_END_RE.finditer(content, a + search_start + 1, b):
+                    pass
+                if last:
+                    a, b = _strip_span(content, a, last.end())
+                    end = start + (b - a)
+            
+            if b - a > 200:  # Lower minimum story length for more stories
+                i = len(texts) + 1
+                texts.append(content[a:b])
+                metas.append({'source': filename, 'type': 'chunk', 'number': i, 'story_id': f"{filename}_chunk_{i}"})
+            
+            start = end
+            # Skip any leading whitespace
+            whitespace = _WS_RE.match(content, start)
+            if whitespace:
+                start = whitespace.end()
+    elif len(content) > 500:
+        # Even short content - split into multiple parts (3-5 parts)
+        num_parts = min(5, max(3, len(content) // 400))  # 3-5 parts based on length
+        part_size = len(content) // num_parts
+        
+        for i in range(num_parts):
+            start = i * part_size
+            end = (i + 1) * part_size if i < num_parts - 1 else len(content)
+            part = content[start:end].strip()
+            
+            # Try to start/end at sentence boundaries
+            if i > 0:
+                # Find sentence start
+                for start_marker in ['. ', '.\n', '! ', '!\n', '? ', '?\n']:
+                    pos = part.find(start_marker)
+                    if pos > 0 and pos < 200:
+                        part = part[pos + 2:]
+                        break
+            
+            if i < num_parts - 1:
+                # Find sentence end
+                search_start = max(0, len(part) - 300)
+                for end_marker in ['. ', '.\n', '! ', '!\n', '? ', '?\n']:
+                    pos = part.rfind(end_marker, search_start)
+                    if pos > search_start:
+                        part = part[:pos + 2]
+                        break
+            
+            if len(part) > 200:
+                texts.append(part)
+                metas.append({'source': filename, 'type': 'part', 'number': i+1, 'story_id': f"{filename}_part_{i+1}"})
+    return texts, metas
+
+def _whole_file_story(content, filename):
+    """Keep the whole text as a single story."""
+    return [content.strip()], [{'source': filename, 'type': 'complete', 'story_id': f"{filename}_complete"}]
+
+def extract_stories_from_file(filepath, *, min_paragraphs=2, min_story_len=300):
     """
     Extract individual stories from a text file.
     Each story is identified by patterns like:
     - Chapter headings
     - Story titles (numbered or titled)
     - Section breaks
+    Strategies are tried in that order and the first to find MIN_STORIES
+    stories is used; books with fewer than MIN_STORIES_PER_BOOK stories are
+    split into fixed-size chunks instead.
+    When grouping paragraphs into stories, a story needs at least
+    min_paragraphs paragraphs and more than min_story_len characters.
+    Returns parallel lists of story texts and their metadata.
     """
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+    content = read_text_file(filepath)
     
-    # Remove Project Gutenberg header/footer
-    content = re.sub(r'\*\*\*.*?END.*?\*\*\*', '', content, flags=re.DOTALL)
-    content = re.sub(r'Project Gutenberg.*?www\.gutenberg\.org.*?\n', '', content, flags=re.DOTALL)
+    # Remove Project Gutenberg header/footer: keep only the text between the
+    # "*** START OF" and "*** END OF" marker lines (plain substring search,
+    # no regex backtracking over the whole book)
+    start = content.find('*** START OF')
+    if start != -1:
+        newline = content.find('\n', start)
+        if newline != -1:
+            content = content[newline + 1:]
+    end = content.find('*** END OF')
+    if end != -1:
+        content = content[:end]
+    # Most books carry no notice lines inside the body; a substring check is
+    # much cheaper than running the regex over the whole text
+    if 'Project Gutenberg' in content:
+        content = _GUTENBERG_NOTICE_RE.sub('', content)
     
-    stories = []
     filename = Path(filepath).stem
     
-    # Try different patterns to split stories
-    # Pattern 1: Chapter headings (CHAPTER I, Chapter 1, etc.)
-    chapter_pattern = r'(?i)(?:^|\n)(?:CHAPTER|Chapter)\s+[IVXLCDM0-9]+[\.:]?\s*\n'
-    # Pattern 2: Numbered stories (1., 2., etc.)
-    numbered_pattern = r'(?i)(?:^|\n)\d+[\.\)]\s+[A-Z]'
-    # Pattern 3: Story titles in all caps or with specific formatting
-    title_pattern = r'(?i)(?:^|\n)(?:THE\s+)?[A-Z][A-Z\s]{10,}\n'
+    strategies = (
+        _try_chapters,
+        _try_numbered,
+        partial(_try_paragraphs, min_paragraphs=min_paragraphs, min_story_len=min_story_len),
+        _try_separators,
+    )
+    for strategy in strategies:
+        texts, metas = strategy(content, filename)
+        if len(texts) >= MIN_STORIES:
+            break
     
-    # Try chapter pattern first
-    chapters = re.split(chapter_pattern, content)
-    if len(chapters) > 2:  # If we found chapters
-        for i, chapter in enumerate(chapters[1:], 1):
-            chapter = chapter.strip()
-            if len(chapter) > 100:  # Minimum story length
-                stories.append({
-                    'text': chapter,
-                    'source': filename,
-                    'story_id': f"{filename}_chapter_{i}",
-                    'metadata': {'source': filename, 'type': 'chapter', 'number': i}
-                })
+    # Very aggressive - want at least 10 stories per book to reach 200+ total
+    if len(texts) >= MIN_STORIES_PER_BOOK:
+        return texts, metas
+    if len(content) <= 500:
+        # Single story if too short
+        return _whole_file_story(content, filename)
+    chunk_texts, chunk_metas = _try_fixed_chunks(content, filename)
+    if chunk_texts:
+        return chunk_texts, chunk_metas
+    return (texts, metas) if texts else _whole_file_story(content, filename)
+
+class EmbeddingCache:
+    """
+    Persistent cache of story embeddings in SQLite, keyed by a SHA-256 of the
+    embedding model name and the story text, so unchanged stories are not
+    re-embedded when the script is run again.
+    """
+
+    LOOKUP_BATCH = 500  # Stay under SQLite's limit on query parameters
+
+    def __init__(self, path, model_name):
+        self.model_name = model_name
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB)")
+        self.conn.commit()
+
+    def key(self, text):
+        """Return the cache key for a text under this cache's model."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, keys):
+        """Return a dict of key -> vector for the keys that are cached."""
+        found = {}
+        for i in range(0, len(keys), self.LOOKUP_BATCH):
+            batch = keys[i:i + self.LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for key, vec in self.conn.execute(
+                f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+            ):
+                found[key] = np.frombuffer(vec, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+            ((key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+async def embed_texts_cached(embeddings, texts, cache, semaphore=None):
+    """
+    Embed texts, reusing cached vectors and only sending cache misses to
+    embed_texts. Returns vectors in input order.
+    """
+    keys = [cache.key(text) for text in texts]
+    cached = cache.get_many(keys)
+    
+    # Embed each missing text once, even if it appears more than once
+    missing = list(dict.fromkeys(key for key in keys if key not in cached))
+    print(f"  {len(texts) - sum(key not in cached for key in keys)} cached, {len(missing)} to embed")
+    if missing:
+        text_by_key = dict(zip(keys, texts))
+        new_vectors = await embed_texts(embeddings, [text_by_key[key] for key in missing], semaphore)
+        cache.put_many(zip(missing, new_vectors))
+        cached.update(zip(missing, new_vectors))
+    
+    return [cached[key] for key in keys]
+
+async def embed_texts(embeddings, texts, semaphore=None):
+    """
+    Embed texts in batches of EMBEDDING_BATCH_SIZE, with up to
+    EMBEDDING_CONCURRENCY batches in flight (or as many as the given
+    semaphore allows, when it is shared between calls). Returns vectors in
+    input order.
+    Rate-limited batches are retried with exponential backoff.
+    Texts are batched longest first so each batch holds texts of similar
+    length, which keeps any one batch from waiting on a single long text.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    
+    # Back off and retry a batch when OpenAI rate-limits us
+    @retry(
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(6),
+        retry=retry_if_exception_type(RateLimitError),
+        reraise=True
+    )
+    async def embed_with_retry(batch):
+        return await embeddings.aembed_documents(batch)
+    
+    async def embed_batch(batch):
+        async with semaphore:
+            # Small random delay so the first wave of requests doesn't land at once
+            await asyncio.sleep(random.uniform(0, EMBEDDING_START_JITTER))
+            return await embed_with_retry(batch)
+    
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    texts_sorted = [texts[i] for i in order]
+    batches = [texts_sorted[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts_sorted), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    
+    # Put the vectors back in the order of the input texts
+    vectors = [None] * len(texts)
+    sorted_vectors = (vector for batch_vectors in results for vector in batch_vectors)
+    for original_index, vector in zip(order, sorted_vectors):
+        vectors[original_index] = vector
+    return vectors
+
+async def ingest_stories(story_files, extract, splitter, embeddings, collection, chroma_batch_size, cache):
+    """
+    Extract, split, embed and store stories as a pipeline. Files are
+    extracted a few at a time in worker processes while earlier batches of
+    INGEST_BATCH_SIZE documents are embedded and written to Chroma.
+    Documents wait in a heap of up to INGEST_HEAP_BATCHES batches and are
+    sent longest first, so batches hold documents of similar length.
+    A failed batch stops the pipeline. Returns the number of stories
+    extracted and documents stored.
+    """
+    loop = asyncio.get_running_loop()
+    embed_semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    pending = asyncio.Semaphore(INGEST_MAX_PENDING)
+    store_lock = asyncio.Lock()  # One Chroma write at a time
+    tasks = []
+    heap = []  # (-length, document number, text, metadata)
+    num_stories = num_docs = 0
     
-    # If no chapters found, try numbered stories
-    if len(stories) < 3:
-        numbered = re.split(numbered_pattern, content)
-        if len(numbered) > 2:
-            stories = []
-            for i, story in enumerate(numbered[1:], 1):
-                story = story.strip()
-                if len(story) > 100:
-                    stories.append({
-                        'text': story,
-                        'source': filename,
-                        'story_id': f"{filename}_story_{i}",
-                        'metadata': {'source': filename, 'type': 'story', 'number': i}
-                    })
+    def store(ids, texts, metadatas, vectors):
+        for start in range(0, len(texts), chroma_batch_size):
+            end = start + chroma_batch_size
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=vectors[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
     
-    # If still no stories, split by large paragraph breaks
-    if len(stories) < 3:
-        # Split by double newlines (paragraph breaks)
-        paragraphs = re.split(r'\n\n+', content)
-        # Group paragraphs into stories (stories are typically 2+ paragraphs for shorter stories)
-        current_story = []
-        story_num = 1
+    async def embed_and_store(ids, texts, metadatas):
+        try:
+            vectors = await embed_texts_cached(embeddings, texts, cache, embed_semaphore)
+            # Write from a thread so embedding requests keep going meanwhile
+            async with store_lock:
+                await asyncio.to_thread(store, ids, texts, metadatas, vectors)
+        finally:
+            pending.release()
+    
+    def raise_if_failed():
+        # Stop extracting and embedding as soon as any batch has failed
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    
+    async def flush():
+        # Send the longest documents waiting in the heap as one batch
+        batch = [heapq.heappop(heap) for _ in range(min(INGEST_BATCH_SIZE, len(heap)))]
+        await pending.acquire()
+        raise_if_failed()
+        tasks.append(asyncio.create_task(embed_and_store(
+            [f"doc_{number}" for _, number, _, _ in batch],
+            [text for _, _, text, _ in batch],
+            [meta for _, _, _, meta in batch]
+        )))
+    
+    with ProcessPoolExecutor() as executor:
+        # Keep only a couple of files per worker extracted ahead of the batcher
+        files = iter(story_files)
+        extract_ahead = 2 * (os.cpu_count() or 1)
+        window = deque()
         
-        for para in paragraphs:
-            para = para.strip()
-            if len(para) > 50:
-                current_story.append(para)
-                # Make a story if we have 2+ paragraphs and it's substantial
-                story_text = '\n\n'.join(current_story)
-                if len(current_story) >= 2 and len(story_text) > 300:
-                    stories.append({
-                        'text': story_text,
-                        'source': filename,
-                        'story_id': f"{filename}_story_{story_num}",
-                        'metadata': {'source': filename, 'type': 'story', 'number': story_num}
-                    })
-                    current_story = []
-                    story_num += 1
+        def submit_next():
+            filepath = next(files, None)
+            if filepath is not None:
+                window.append((filepath, loop.run_in_executor(executor, extract, filepath)))
         
-        # Add remaining paragraphs as last story
-        if current_story and len('\n\n'.join(current_story)) > 300:
-            story_text = '\n\n'.join(current_story)
-            stories.append({
-                'text': story_text,
-                'source': filename,
-                'story_id': f"{filename}_story_{story_num}",
-                'metadata': {'source': filename, 'type': 'story', 'number': story_num}
-            })
-    
-    # If still no good splits, split by sentences/paragraphs to create more stories
-    if len(stories) < 3:
-        # Try splitting by multiple newlines or section markers
-        # Look for common story separators
-        separators = [
-            r'\n\n\n+',  # Triple newlines
-            r'\n\s*[A-Z][A-Z\s]{15,}\n',  # All caps titles
-            r'\n\s*\d+\.\s+[A-Z]',  # Numbered items
-            r'\n\s*[IVX]+\.\s+[A-Z]',  # Roman numerals
-        ]
+        for _ in range(extract_ahead):
+            submit_next()
         
-        for sep_pattern in separators:
-            parts = re.split(sep_pattern, content)
-            if len(parts) > 3:
-                stories = []
-                for i, part in enumerate(parts, 1):
-                    part = part.strip()
-                    if len(part) > 200:  # Minimum story length
-                        stories.append({
-                            'text': part,
-                            'source': filename,
-                            'story_id': f"{filename}_section_{i}",
-                            'metadata': {'source': filename, 'type': 'section', 'number': i}
-                        })
-                if len(stories) >= 3:
-                    break
-    
-    # Final fallback: split into chunks of reasonable size
-    # This ensures we always get multiple stories from each book
-    # Very aggressive - want at least 10-15 stories per book to reach 200+ total
-    if len(stories) < 10:  # Very aggressive - want at least 10 stories per book
-        if len(content) > 1000:
-            # Split into smaller chunks (1000-1500 characters) to get more stories
-            # Smaller chunks = more stories
-            chunk_size = 1200  # Smaller chunks for more stories
-            chunks = []
-            start = 0
-            
-            while start < len(content):
-                end = start + chunk_size
-                chunk = content[start:end].strip()
-                
-                # Try to end at a sentence boundary for better story breaks
-                if end < len(content):
-                    # Look for sentence endings in the last 30% of chunk
-                    search_start = int(len(chunk) * 0.7)
-                    for end_marker in ['. ', '.\n', '! ', '!\n', '? ', '?\n', '.\n\n']:
-                        last_pos = chunk.rfind(end_marker, search_start)
-                        if last_pos > search_start:
-                            chunk = chunk[:last_pos + len(end_marker)].strip()
-                            end = start + len(chunk)
-                            break
-                
-                if len(chunk) > 200:  # Lower minimum story length for more stories
-                    chunks.append(chunk)
-                
-                start = end
-                # Skip any leading whitespace
-                while start < len(content) and content[start] in ' \n\t':
-                    start += 1
+        while window:
+            filepath, future = window.popleft()
+            texts, metas = await future
+            raise_if_failed()
+            submit_next()
+            print(f"Processing {filepath.name}...")
+            print(f"  ✓ Extracted {len(texts)} stories/chapters")
+            num_stories += len(texts)
             
-            if len(chunks) > 0:
-                stories = []
-                for i, chunk in enumerate(chunks, 1):
-                    stories.append({
-                        'text': chunk,
-                        'source': filename,
-                        'story_id': f"{filename}_chunk_{i}",
-                        'metadata': {'source': filename, 'type': 'chunk', 'number': i}
-                    })
-        elif len(content) > 500:
-            # Even short content - split into multiple parts (3-5 parts)
-            num_parts = min(5, max(3, len(content) // 400))  # 3-5 parts based on length
-            part_size = len(content) // num_parts
-            stories = []
-            
-            for i in range(num_parts):
-                start = i * part_size
-                end = (i + 1) * part_size if i < num_parts - 1 else len(content)
-                part = content[start:end].strip()
-                
-                # Try to start/end at sentence boundaries
-                if i > 0:
-                    # Find sentence start
-                    for start_marker in ['. ', '.\n', '! ', '!\n', '? ', '?\n']:
-                        pos = part.find(start_marker)
-                        if pos > 0 and pos < 200:
-                            part = part[pos + 2:]
-                            break
-                
-                if i < num_parts - 1:
-                    # Find sentence end
-                    search_start = max(0, len(part) - 300)
-                    for end_marker in ['. ', '.\n', '! ', '!\n', '? ', '?\n']:
-                        pos = part.rfind(end_marker, search_start)
-                        if pos > search_start:
-                            part = part[:pos + 2]
-                            break
-                
-                if len(part) > 200:
-                    stories.append({
-                        'text': part,
-                        'source': filename,
-                        'story_id': f"{filename}_part_{i+1}",
-                        'metadata': {'source': filename, 'type': 'part', 'number': i+1}
-                    })
-        else:
-            # Single story if too short
-            stories = [{
-                'text': content.strip(),
-                'source': filename,
-                'story_id': f"{filename}_complete",
-                'metadata': {'source': filename, 'type': 'complete'}
-            }]
+            # Split long stories so every document already fits the app's
+            # prompt context without truncation
+            for story_text, story_meta in zip(texts, metas):
+                for text in splitter.split_text(story_text):
+                    # Documents are numbered in extraction order, whatever
+                    # batch they end up in
+                    heapq.heappush(heap, (-len(text), num_docs, text, {**story_meta, 'length': len(text)}))
+                    num_docs += 1
+                    if len(heap) >= INGEST_BATCH_SIZE * INGEST_HEAP_BATCHES:
+                        await flush()
+        
+        # Report the extraction results now rather than after all embedding
+        print(f"\nTotal stories extracted: {num_stories}")
+        
+        if num_stories < 200:
+            print(f"\n⚠️  WARNING: Only {num_stories} stories found. Target is 200+.")
+            print("You may want to download more books or adjust extraction logic.")
+        
+        while heap:
+            await flush()
+    
+    await asyncio.gather(*tasks)
+    return num_stories, num_docs
+
+def export_search_index(collection, embedding_model, export_path="./search_index"):
+    """
+    Write a read-only export of the vector database for app.py to serve from
+    without opening Chroma: L2-normalized fp16 vectors in vectors.npy (loaded
+    with mmap) and the story text and metadata as columns in stories.json.
+    """
+    data = collection.get(include=['embeddings', 'documents', 'metadatas'])
     
-    return stories
+    # Batches may reach Chroma in any order; export in document order. The
+    # collection is rebuilt on every run, so every id is one written as doc_N.
+    order = sorted(range(len(data['ids'])), key=lambda i: int(data['ids'][i].rpartition('_')[2]))
+    vectors = np.asarray(data['embeddings'], dtype=np.float32)[order]
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    
+    documents = [data['documents'][i] for i in order]
+    metadatas = [data['metadatas'][i] or {} for i in order]
+    columns = {
+        'text': documents,
+        'source': [meta.get('source', 'Unknown') for meta in metadatas],
+        'type': [meta.get('type', 'story') for meta in metadatas],
+        'number': [meta.get('number', 'N/A') for meta in metadatas],
+        'length': [meta.get('length', len(text)) for meta, text in zip(metadatas, documents)],
+    }
+    
+    os.makedirs(export_path, exist_ok=True)
+    np.save(os.path.join(export_path, "vectors.npy"), vectors.astype(np.float16))
+    with open(os.path.join(export_path, "stories.json"), 'w', encoding='utf-8') as f:
+        json.dump({'embedding_model': embedding_model, 'max_story_chars': MAX_STORY_CHARS, 'columns': columns}, f)
 
-def process_all_stories():
+def process_all_stories(min_paragraphs=2, min_story_len=300):
     """Process all story files and create vector database."""
     print("=" * 60)
     print("JStory - Story Processing Script")
     print("=" * 60)
     
-    # Check for API key
+    # Check for API key (only needed when embedding with OpenAI)
+    uses_openai = not EMBEDDING_MODEL.startswith("sentence-transformers/")
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_openai_api_key_here":
+    if uses_openai and (not api_key or api_key == "your_openai_api_key_here"):
         print("\n⚠️  ERROR: OPENAI_API_KEY not set as environment variable")
         print("Please set OPENAI_API_KEY in your terminal session.")
         print("Windows PowerShell: $env:OPENAI_API_KEY='your_key_here'")
@@ -291,51 +659,60 @@ def process_all_stories():
         return
     
     print(f"\nFound {len(story_files)} story files")
-    print("Extracting stories from files...\n")
     
-    # Extract all stories
-    all_stories = []
-    for filepath in story_files:
-        print(f"Processing {filepath.name}...")
-        stories = extract_stories_from_file(filepath)
-        print(f"  ✓ Extracted {len(stories)} stories/chapters")
-        all_stories.extend(stories)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=MAX_STORY_CHARS,
+        chunk_overlap=STORY_CHUNK_OVERLAP
+    )
     
-    print(f"\nTotal stories extracted: {len(all_stories)}")
+    # Initialize embeddings
+    print(f"\nInitializing embeddings ({EMBEDDING_MODEL})...")
+    embeddings = create_embeddings(EMBEDDING_MODEL)
     
-    if len(all_stories) < 200:
-        print(f"\n⚠️  WARNING: Only {len(all_stories)} stories found. Target is 200+.")
-        print("You may want to download more books or adjust extraction logic.")
+    # Rebuild the collection from scratch: rows from an earlier run (or another
+    # embedding model) must not mix into the new index, and collection
+    # metadata is only set when a collection is created
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    try:
+        client.delete_collection(CHROMA_COLLECTION)
+    except (ValueError, chromadb.errors.ChromaError):
+        pass  # No collection yet
+    collection = client.create_collection(
+        CHROMA_COLLECTION,
+        # Recorded so app.py embeds queries with the same model and knows
+        # stories fit in its prompt without truncation
+        metadata={"embedding_model": EMBEDDING_MODEL, "max_story_chars": MAX_STORY_CHARS}
+    )
     
-    # Create LangChain Documents
-    documents = []
-    for story in all_stories:
-        doc = Document(
-            page_content=story['text'],
-            metadata=story['metadata']
+    # Extract stories in worker processes, embedding and storing them in
+    # batches as they come in
+    print("Extracting, embedding and storing stories...\n")
+    extract = partial(extract_stories_from_file, min_paragraphs=min_paragraphs, min_story_len=min_story_len)
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL)
+    try:
+        _, num_docs = asyncio.run(
+            ingest_stories(story_files, extract, splitter, embeddings, collection,
+                           client.get_max_batch_size(), embedding_cache)
         )
-        documents.append(doc)
+    finally:
+        embedding_cache.close()
     
-    # Initialize embeddings
-    print("\nInitializing OpenAI embeddings...")
-    # SSL verification is disabled globally via httpx patch above
-    # This allows OpenAIEmbeddings to create its own client internally
-    embeddings = OpenAIEmbeddings()
-    
-    # Create vector store
-    print("Creating vector database...")
-    vector_store = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
-        persist_directory="./chroma_db"
-    )
+    print("Exporting search index...")
+    export_search_index(collection, EMBEDDING_MODEL)
     
-    print(f"\n✓ Successfully created vector database with {len(documents)} stories!")
+    print(f"\n✓ Successfully created vector database with {num_docs} stories!")
     print("✓ Database saved to ./chroma_db")
+    print("✓ Search index exported to ./search_index")
     print("\n" + "=" * 60)
     print("Ready to use! You can now run the Flask app with: python app.py")
     print("=" * 60)
 
 if __name__ == "__main__":
-    process_all_stories()
+    parser = argparse.ArgumentParser(description="Extract stories, embed them and build the vector database.")
+    parser.add_argument("--min-paragraphs", type=int, default=2,
+                        help="Minimum paragraphs per story when grouping paragraphs (default: 2)")
+    parser.add_argument("--min-story-len", type=int, default=300,
+                        help="Minimum characters per story when grouping paragraphs (default: 300)")
+    args = parser.parse_args()
+    process_all_stories(min_paragraphs=args.min_paragraphs, min_story_len=args.min_story_len)
 